@@ -1,40 +1,198 @@
 # Add to top with other imports
 import os
+import gzip
+import io
 from dotenv import load_dotenv  # For development only
-from flask import Flask, render_template, request, redirect, url_for, session, flash, Response
-import psycopg2
-import psycopg2.extras
+from flask import Flask, render_template, request, redirect, url_for, session, flash, Response, stream_with_context, g, has_app_context
+import psycopg
+from psycopg import sql as pgsql
+from psycopg.conninfo import make_conninfo
+from psycopg.pq import TransactionStatus
+from psycopg.rows import dict_row
+from psycopg_pool import ConnectionPool
 import bcrypt
-import pytz
+from zoneinfo import ZoneInfo
 import random
+import re
 import string
 from werkzeug.security import generate_password_hash, check_password_hash
-from datetime import datetime
+from datetime import datetime, timezone
 from calendar import monthrange
-from psycopg2 import Error as Psycopg2Error
-from forms import ScheduleForm 
-from psycopg2 import IntegrityError
+from functools import lru_cache, wraps
+from forms import ScheduleForm
 
 load_dotenv()  # Load .env file in development
 
 # --- App Configuration ---
 app = Flask(__name__)
 app.secret_key = os.getenv('SECRET_KEY')  # Required in production
-local_tz = pytz.timezone(os.getenv('TZ', 'UTC'))  # Default to UTC
+local_tz = ZoneInfo(os.getenv('TZ', 'UTC'))  # Default to UTC
+UTC = timezone.utc  # cached so per-row loops skip the module attribute lookup
+
+
+def _to_local(dt):
+    """Convert a naive UTC datetime to an aware local one"""
+    return dt.replace(tzinfo=UTC).astimezone(local_tz)
+
+
+@lru_cache(maxsize=256)
+def _month_bounds_utc(year, month):
+    """Naive-UTC start and end of the given month in local time.
+
+    Naive on purpose: created_at is a naive-UTC timestamp column, and
+    tz-aware bounds would bind as timestamptz, making PostgreSQL shift
+    the comparison through the session TimeZone.
+    """
+    start_local = datetime(year, month, 1, 0, 0, 0, tzinfo=local_tz)
+    end_day = monthrange(year, month)[1]
+    end_local = datetime(year, month, end_day, 23, 59, 59, tzinfo=local_tz)
+    return (start_local.astimezone(UTC).replace(tzinfo=None),
+            end_local.astimezone(UTC).replace(tzinfo=None))
 
 
 # --- Database Configuration ---
-def get_db():
-    conn = psycopg2.connect(
-         host=os.getenv('DB_HOST'),
-        database=os.getenv('DB_NAME'),
+# Shared pool so each request reuses an open connection instead of paying
+# a full TCP/auth handshake per request
+POOL = ConnectionPool(
+    conninfo=make_conninfo(
+        host=os.getenv('DB_HOST'),
+        dbname=os.getenv('DB_NAME'),
         user=os.getenv('DB_USER'),
         password=os.getenv('DB_PASSWORD', ''),
-        port=os.getenv('DB_PORT')
-    )
-    conn.autocommit = True
+        port=os.getenv('DB_PORT'),
+    ),
+    min_size=2,
+    max_size=20,
+    kwargs={'autocommit': True},
+)
+
+
+def get_db():
+    conn = POOL.getconn()
+    if has_app_context():
+        # Track checked-out connections so teardown can reclaim them
+        # if a view raises before calling close_db()
+        g.setdefault('_db_conns', []).append(conn)
     return conn
-    
+
+
+def close_db(conn):
+    if conn.info.transaction_status in (TransactionStatus.INTRANS, TransactionStatus.INERROR):
+        conn.rollback()
+    if has_app_context() and conn in g.get('_db_conns', []):
+        g._db_conns.remove(conn)
+    POOL.putconn(conn)
+
+
+@app.teardown_appcontext
+def release_db_conns(exception):
+    # Safety net: return any connection a view failed to release, so
+    # exceptions don't slowly drain the pool
+    if has_app_context():
+        for conn in g.pop('_db_conns', []):
+            if conn.info.transaction_status in (TransactionStatus.INTRANS, TransactionStatus.INERROR):
+                conn.rollback()
+            POOL.putconn(conn)
+
+
+def admin_required(view):
+    """Reject non-admin sessions before the view body runs.
+
+    Replaces the guard that every admin view repeated inline, and keeps
+    unauthorized requests from ever touching the connection pool.
+    """
+    @wraps(view)
+    def wrapped(*args, **kwargs):
+        if 'user_id' not in session or not session.get('is_admin'):
+            flash('Access denied.', 'danger')
+            return redirect(url_for('index'))
+        return view(*args, **kwargs)
+    return wrapped
+
+
+def _page_args():
+    """Parse and sanitize the keyset pagination query args.
+
+    Clamps limit to 1..200 and drops an unparseable cursor so a bad
+    query string falls back to page one instead of erroring.
+    """
+    after_created_at = request.args.get('after_created_at')
+    after_id = request.args.get('after_id', type=int)
+    limit = max(1, min(request.args.get('limit', 50, type=int), 200))
+
+    after_dt = None
+    if after_created_at and after_id is not None:
+        try:
+            after_dt = datetime.fromisoformat(after_created_at)
+        except ValueError:
+            after_id = None
+    return after_dt, after_id, limit
+
+
+# --- Migrations ---
+MIGRATIONS_DIR = os.path.join(os.path.dirname(__file__), 'migrations')
+VERSION_RE = re.compile(r'^(\d+)_')  # leading number of e.g. 001_add_indexes.sql
+
+
+def apply_migrations():
+    """Apply any .sql scripts in migrations/ that have not run yet"""
+    conn = get_db()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS applied_migrations (
+                    version TEXT PRIMARY KEY,
+                    applied_at TIMESTAMP NOT NULL DEFAULT NOW()
+                )
+            """)
+
+            cursor.execute("SELECT version FROM applied_migrations")
+            applied = {row[0] for row in cursor.fetchall()}
+
+            entries = sorted(e.name for e in os.scandir(MIGRATIONS_DIR)
+                             if e.name.endswith('.sql'))
+            newly_applied = []
+            try:
+                for filename in entries:
+                    match = VERSION_RE.match(filename)
+                    if not match:
+                        continue
+                    version = match.group(1)
+                    if version in applied:
+                        continue
+
+                    with open(os.path.join(MIGRATIONS_DIR, filename)) as f:
+                        sql_script = f.read()
+
+                    try:
+                        # One execute for the whole script: a single roundtrip,
+                        # and no splitting on ';' (which breaks on semicolons
+                        # inside function bodies or dollar-quoted strings)
+                        cursor.execute(sql_script)
+                        newly_applied.append(version)
+                        print(f"Applied migration {filename}")
+                    except psycopg.Error as e:
+                        print(f"Migration {filename} failed: {e}")
+                        raise
+            finally:
+                # psycopg batches executemany through pipeline mode, so
+                # this is one roundtrip; runs in the finally so scripts
+                # that already executed (autocommit) stay recorded even
+                # if a later one fails
+                if newly_applied:
+                    cursor.executemany(
+                        "INSERT INTO applied_migrations (version) VALUES (%s)",
+                        [(v,) for v in newly_applied]
+                    )
+    finally:
+        close_db(conn)
+
+
+# At import time, not under `if __name__ == '__main__'`: the deploy runs
+# `gunicorn app:app`, which imports the module and never executes that
+# block, so migrations would only ever run on the dev server
+apply_migrations()
+
 
 @app.context_processor
 def inject_now():
@@ -49,7 +207,7 @@ def format_date_filter(value, format_str):
     
     # If datetime is naive, assume it's UTC
     if value.tzinfo is None:
-        value = pytz.utc.localize(value)
+        value = value.replace(tzinfo=UTC)
     
     try:
         local_time = value.astimezone(local_tz)
@@ -67,7 +225,7 @@ def index():
 
     
     conn = get_db()
-    cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+    cursor = conn.cursor(row_factory=dict_row)
 
     user = None
     latest_reading = None
@@ -96,12 +254,14 @@ def index():
             latest_reading = dict(reading_row)
             created_at_utc = latest_reading['created_at']
             if created_at_utc.tzinfo is None:
-                created_at_utc = created_at_utc.replace(tzinfo=pytz.utc)
-            latest_reading['formatted_date'] = created_at_utc.astimezone(local_tz).strftime('%b %d, %Y %I:%M %p')
+                created_at_local = _to_local(created_at_utc)
+            else:
+                created_at_local = created_at_utc.astimezone(local_tz)
+            latest_reading['formatted_date'] = created_at_local.strftime('%b %d, %Y %I:%M %p')
 
         # Get total readings count
-        cursor.execute("SELECT COUNT(*) FROM meter_readings WHERE user_id = %s", (session['user_id'],))
-        readings_count = cursor.fetchone()[0]
+        cursor.execute("SELECT COUNT(*) AS count FROM meter_readings WHERE user_id = %s", (session['user_id'],))
+        readings_count = cursor.fetchone()['count']
 
         # Get upcoming schedules
         cursor.execute("""
@@ -118,18 +278,19 @@ def index():
             schedule = dict(row)
             scheduled_date_utc = schedule['scheduled_date']
             if scheduled_date_utc.tzinfo is None:
-                scheduled_date_utc = scheduled_date_utc.replace(tzinfo=pytz.utc)
-            schedule['scheduled_date'] = scheduled_date_utc.astimezone(local_tz)
+                schedule['scheduled_date'] = _to_local(scheduled_date_utc)
+            else:
+                schedule['scheduled_date'] = scheduled_date_utc.astimezone(local_tz)
             schedules.append(schedule)
 
         # Get count of upcoming schedules
         cursor.execute("""
-            SELECT COUNT(*)
+            SELECT COUNT(*) AS count
             FROM schedules
             WHERE is_completed = FALSE
               AND scheduled_date >= NOW()
         """)
-        upcoming_schedules_count = cursor.fetchone()[0]
+        upcoming_schedules_count = cursor.fetchone()['count']
 
 
              # Announcement
@@ -146,12 +307,12 @@ def index():
             announcement_item['created_at'] = announcement_item['created_at'].astimezone(local_tz)
             announcements.append(announcement_item)
 
-    except psycopg2.Error as e:
-        flash(f"Error fetching data: {e.pgerror}", 'danger')
+    except psycopg.Error as e:
+        flash(f"Error fetching data: {e}", 'danger')
 
     finally:
         cursor.close()
-        conn.close()
+        close_db(conn)
 
     return render_template('index.html',
                            user=user,
@@ -174,7 +335,7 @@ def login():
 
         conn = get_db()
         try:
-            with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cursor:
+            with conn.cursor(row_factory=dict_row) as cursor:
                 cursor.execute("SELECT * FROM users WHERE username = %s", (username,))
                 user = cursor.fetchone()
 
@@ -186,10 +347,10 @@ def login():
                     return redirect(url_for('index'))
                 else:
                     flash('Invalid username or password', 'danger')
-        except psycopg2.Error as e:
+        except psycopg.Error as e:
             flash(f'Database error: {str(e)}', 'danger')
         finally:
-            conn.close()
+            close_db(conn)
 
     # Always return this for GET requests or after failure
     return render_template('login.html')
@@ -215,7 +376,7 @@ def register():
 
         conn = get_db()
         try:
-            with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cursor:
+            with conn.cursor(row_factory=dict_row) as cursor:
                 cursor.execute("""
                     SELECT * FROM users
                     WHERE username = %s OR email = %s OR unit_number = %s
@@ -241,24 +402,21 @@ def register():
                 flash('Registration successful! Please login.', 'success')
                 return redirect(url_for('login'))
 
-        except psycopg2.Error as e:
+        except psycopg.Error as e:
             conn.rollback()
             flash(f'Database error: {e}', 'danger')
             return redirect(url_for('register'))
 
         finally:
-            conn.close()
+            close_db(conn)
 
     return render_template('register.html')
 
 
 # Promote user
 @app.route('/admin/promote', methods=['POST'])
+@admin_required
 def promote_user():
-    if not session.get('is_admin', False):
-        flash('Access denied', 'danger')
-        return redirect(url_for('dashboard'))
-
     user_id = request.form['user_id']
     conn = get_db()
     try:
@@ -274,21 +432,18 @@ def promote_user():
             if result:
                 status = "Admin" if result[1] else "Regular"
                 flash(f"{result[0]} status: {status}", 'success')
-    except psycopg2.Error as e:
+    except psycopg.Error as e:
         flash(f'Update failed: {str(e)}', 'danger')
     finally:
-        conn.close()
+        close_db(conn)
     
     return redirect(url_for('view_users'))
 
 
 # Delete user
 @app.route('/admin/delete_user/<int:user_id>', methods=['POST'])
+@admin_required
 def delete_user(user_id):
-    if not session.get('is_admin'):
-        flash('Access denied', 'danger')
-        return redirect(url_for('dashboard')) # Or appropriate redirect
-
     conn = get_db()
     try:
         with conn.cursor() as cursor:
@@ -306,11 +461,11 @@ def delete_user(user_id):
             flash('User deleted successfully', 'success')
             conn.commit()
 
-    except psycopg2.Error as e:
+    except psycopg.Error as e:
         conn.rollback()
-        flash(f'Delete user failed: {e.pgerror}', 'danger')
+        flash(f'Delete user failed: {e}', 'danger')
     finally:
-        conn.close()
+        close_db(conn)
 
     return redirect(url_for('view_users')) 
 
@@ -322,7 +477,7 @@ def announcements():
         return redirect(url_for('login'))
 
     conn = get_db()
-    cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+    cursor = conn.cursor(row_factory=dict_row)
     announcements_list = []
 
     try:
@@ -337,15 +492,16 @@ def announcements():
             # Convert UTC to local timezone
             utc_time = ann['created_at']
             if utc_time.tzinfo is None:
-                utc_time = pytz.utc.localize(utc_time)
-            ann['created_at'] = utc_time.astimezone(local_tz)
+                ann['created_at'] = _to_local(utc_time)
+            else:
+                ann['created_at'] = utc_time.astimezone(local_tz)
             announcements_list.append(ann)
 
-    except psycopg2.Error as e:
-        flash(f'Error loading announcements: {e.pgerror}', 'danger')
+    except psycopg.Error as e:
+        flash(f'Error loading announcements: {e}', 'danger')
     finally:
         cursor.close()
-        conn.close()
+        close_db(conn)
 
     return render_template('announcements.html',
                          announcements=announcements_list,
@@ -377,11 +533,11 @@ def meter():
                 VALUES (%s, %s, %s)
             """, (session['user_id'], reading, notes))
             flash('Reading saved successfully!', 'success')
-        except psycopg2.Error as e:
-            flash(f'Error saving reading: {e.pgerror}', 'danger')
+        except psycopg.Error as e:
+            flash(f'Error saving reading: {e}', 'danger')
         finally:
             cursor.close()
-            conn.close()
+            close_db(conn)
 
         return redirect(url_for('meter'))
 
@@ -395,7 +551,7 @@ def history():
         return redirect(url_for('login'))
 
     conn = get_db()
-    cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+    cursor = conn.cursor(row_factory=dict_row)
     formatted_readings = []
 
     try:
@@ -406,54 +562,59 @@ def history():
             ORDER BY created_at DESC
         """, (session['user_id'],))
 
+        # Bind lookups to locals before the loop: LOAD_FAST per row
+        # instead of global/attribute chains
+        to_local = _to_local
+        tz = local_tz
+        append = formatted_readings.append
+
         for row in cursor.fetchall():
             # Get the datetime object from the database row
             dt_from_db = row['created_at']
 
             # Check if the datetime object is naive (no tzinfo)
             if dt_from_db.tzinfo is None:
-                # If naive, assume it's UTC and localize it
-                created_at_utc_aware = pytz.utc.localize(dt_from_db)
+                # If naive, assume it's UTC and convert in one call
+                created_at_local = to_local(dt_from_db)
             else:
-                # If already timezone-aware, use it directly (it's likely already in UTC or its original timezone)
-                created_at_utc_aware = dt_from_db
+                # If already timezone-aware, convert directly
+                created_at_local = dt_from_db.astimezone(tz)
 
-            # Now convert the timezone-aware datetime to the local timezone
-            created_at_local = created_at_utc_aware.astimezone(local_tz)
+            # f-strings on the datetime components beat strftime, which
+            # re-parses its format string on every call
+            hour, minute = created_at_local.hour, created_at_local.minute
+            date_s = f"{created_at_local.year:04d}-{created_at_local.month:02d}-{created_at_local.day:02d}"
 
-            formatted_readings.append({
+            append({
                 'id': row['id'],
                 'reading': row['reading'],
                 'notes': row['notes'],
-                'date': created_at_local.strftime('%Y-%m-%d'),
-                'time': created_at_local.strftime('%H:%M:%S'),
-                'datetime': created_at_local.strftime('%Y-%m-%d %H:%M'),
+                'date': date_s,
+                'time': f"{hour:02d}:{minute:02d}:{created_at_local.second:02d}",
+                'datetime': f"{date_s} {hour:02d}:{minute:02d}",
             })
 
-    except psycopg2.Error as e:
-        flash(f"Error fetching history: {e.pgerror}", 'danger')
+    except psycopg.Error as e:
+        flash(f"Error fetching history: {e}", 'danger')
     finally:
         cursor.close()
-        conn.close()
+        close_db(conn)
 
     return render_template('history.html', readings=formatted_readings)
 
 
 # Create schedule
 @app.route('/admin/schedules/create', methods=['GET', 'POST'])
+@admin_required
 def create_schedule():
-    if not session.get('is_admin'):
-        flash('Access denied.', 'danger')
-        return redirect(url_for('dashboard'))
-
     form = ScheduleForm()
 
     if form.validate_on_submit():
         conn = None
         try:
             # Convert local datetime to UTC
-            local_dt = local_tz.localize(form.scheduled_date.data)
-            utc_dt = local_dt.astimezone(pytz.utc)
+            local_dt = form.scheduled_date.data.replace(tzinfo=local_tz)
+            utc_dt = local_dt.astimezone(UTC)
 
             conn = get_db()
             cursor = conn.cursor()
@@ -474,12 +635,12 @@ def create_schedule():
             flash('System-wide schedule created!', 'success')
             return redirect(url_for('admin_schedules'))
 
-        except psycopg2.Error as e:
+        except psycopg.Error as e:
             conn.rollback()
-            flash(f'Database error: {e.pgerror}', 'danger')
+            flash(f'Database error: {e}', 'danger')
         finally:
             if conn:
-                conn.close()
+                close_db(conn)
 
     return render_template('create_schedule.html', form=form)
 
@@ -487,11 +648,8 @@ def create_schedule():
 
 # --- Admin: Post Announcement ---
 @app.route('/admin/announce', methods=['GET', 'POST'])
+@admin_required
 def post_announcement():
-    if 'user_id' not in session or not session.get('is_admin'):
-        flash('Access denied.', 'danger')
-        return redirect(url_for('dashboard'))
-
     if request.method == 'POST':
         title = request.form['title']
         message = request.form['message']
@@ -509,33 +667,30 @@ def post_announcement():
             conn.commit() # Don't forget to commit
             flash('Announcement posted successfully!', 'success')
             return redirect(url_for('admin_dashboard')) # Redirect to admin dashboard after success
-        except psycopg2.Error as e:
+        except psycopg.Error as e:
             conn.rollback() # Rollback on error
-            flash(f'Error posting announcement: {e.pgerror}', 'danger')
+            flash(f'Error posting announcement: {e}', 'danger')
         finally:
             cursor.close()
-            conn.close()
+            close_db(conn)
 
     return render_template('admin_announcements.html')
 
 # --- Delete Announcement Route ---
 @app.route('/delete-announcement/<int:announcement_id>', methods=['POST'])
+@admin_required
 def delete_announcement(announcement_id):
-    if not session.get('is_admin'):
-        flash('Access denied', 'danger')
-        return redirect(url_for('announcements'))
-
     conn = get_db()
     try:
         with conn.cursor() as cursor:
             cursor.execute("DELETE FROM announcements WHERE id = %s", (announcement_id,))
             conn.commit()
             flash('Announcement deleted successfully', 'success')
-    except psycopg2.Error as e:
+    except psycopg.Error as e:
         conn.rollback()
-        flash(f'Delete failed: {e.pgerror}', 'danger')
+        flash(f'Delete failed: {e}', 'danger')
     finally:
-        conn.close()
+        close_db(conn)
     
     return redirect(url_for('announcements'))
 
@@ -547,7 +702,7 @@ def user_schedules():
         return redirect(url_for('login'))
 
     conn = get_db()
-    cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+    cursor = conn.cursor(row_factory=dict_row)
     schedules = []
     current_time_local = datetime.now(local_tz) # Get current time in local timezone
 
@@ -573,8 +728,9 @@ def user_schedules():
             # Convert to local timezone
             scheduled_date_utc = schedule['scheduled_date']
             if scheduled_date_utc.tzinfo is None:
-                scheduled_date_utc = pytz.utc.localize(scheduled_date_utc) # Localize as UTC if naive
-            schedule['scheduled_date'] = scheduled_date_utc.astimezone(local_tz)
+                schedule['scheduled_date'] = _to_local(scheduled_date_utc) # Treat naive as UTC
+            else:
+                schedule['scheduled_date'] = scheduled_date_utc.astimezone(local_tz)
 
             # Add is_past and is_completed logic for template
             schedule['is_past'] = schedule['scheduled_date'] < current_time_local and not schedule['is_completed']
@@ -585,11 +741,11 @@ def user_schedules():
 
             schedules.append(schedule)
 
-    except psycopg2.Error as e:
-        flash(f"Error fetching schedules: {e.pgerror}", 'danger')
+    except psycopg.Error as e:
+        flash(f"Error fetching schedules: {e}", 'danger')
     finally:
         cursor.close()
-        conn.close()
+        close_db(conn)
 
     # Pass is_admin to the template
     return render_template('schedule.html',
@@ -600,12 +756,8 @@ def user_schedules():
 
 # Route to mark a schedule as complete
 @app.route('/admin/schedules/complete/<int:schedule_id>', methods=['POST'])
+@admin_required
 def complete_schedule(schedule_id):
-    # Ensure only admins can access this route
-    if not session.get('is_admin'):
-        flash('Access denied.', 'danger')
-        return redirect(url_for('admin_schedules')) # Redirect to admin schedules or dashboard
-
     conn = get_db()
     cursor = conn.cursor()
     try:
@@ -615,12 +767,12 @@ def complete_schedule(schedule_id):
         )
         conn.commit()
         flash('Schedule marked as completed!', 'success')
-    except psycopg2.Error as e:
+    except psycopg.Error as e:
         conn.rollback()
-        flash(f'Error marking schedule complete: {e.pgerror}', 'danger')
+        flash(f'Error marking schedule complete: {e}', 'danger')
     finally:
         cursor.close()
-        conn.close()
+        close_db(conn)
 
     # Redirect back to the admin schedules page after the action
     return redirect(url_for('admin_schedules'))
@@ -648,11 +800,14 @@ def submit_reading():
             flash('Invalid reading format')
             return redirect(url_for('submit_reading'))
 
-        with get_db() as cur:
-            cur.execute("""
+        conn = get_db()
+        try:
+            conn.execute("""
                 INSERT INTO meter_readings (user_id, reading)
                 VALUES (%s, %s)
             """, (session['user_id'], reading))
+        finally:
+            close_db(conn)
 
         flash('Reading submitted')
         return redirect(url_for('dashboard'))
@@ -668,7 +823,7 @@ def schedule():
 
     if request.method == 'GET':
         conn = get_db()
-        cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+        cursor = conn.cursor(row_factory=dict_row)
         try:
             # Get user's schedules
             cursor.execute("""
@@ -683,26 +838,23 @@ def schedule():
                 schedule = dict(row)
                 # Ensure datetime is timezone-aware
                 if schedule['scheduled_date'].tzinfo is None:
-                    schedule['scheduled_date'] = pytz.utc.localize(schedule['scheduled_date'])
+                    schedule['scheduled_date'] = schedule['scheduled_date'].replace(tzinfo=UTC)
                 schedules.append(schedule)
                 
-        except psycopg2.Error as e:
-            flash(f"Error fetching schedules: {e.pgerror}", 'danger')
+        except psycopg.Error as e:
+            flash(f"Error fetching schedules: {e}", 'danger')
         finally:
             cursor.close()
-            conn.close()
+            close_db(conn)
             
         return render_template('schedule.html', schedules=schedules)
     
 # Admin schedule
 @app.route('/admin/schedules')
+@admin_required
 def admin_schedules():
-    if not session.get('is_admin'):
-        flash('Access denied', 'danger')
-        return redirect(url_for('dashboard'))
-
     conn = get_db()
-    cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+    cursor = conn.cursor(row_factory=dict_row)
     schedules = []
 
     try:
@@ -720,197 +872,209 @@ def admin_schedules():
             schedule['scheduled_date'] = schedule['scheduled_date'].astimezone(local_tz)
             schedules.append(schedule)
 
-    except psycopg2.Error as e:
-        flash(f'Database error: {e.pgerror}', 'danger')
+    except psycopg.Error as e:
+        flash(f'Database error: {e}', 'danger')
     finally:
         cursor.close()
-        conn.close()
+        close_db(conn)
 
     return render_template('admin_schedules.html', schedules=schedules)   
 
 
 # Delete schedule
 @app.route('/admin/delete-schedule/<int:schedule_id>', methods=['POST'])
+@admin_required
 def delete_schedule(schedule_id):
-    if not session.get('is_admin'):
-        flash('Access denied', 'danger')
-        return redirect(url_for('dashboard'))
-
     conn = get_db()
     try:
         with conn.cursor() as cursor:
             cursor.execute("DELETE FROM schedules WHERE id = %s", (schedule_id,))
             flash('Schedule deleted successfully', 'success')
-    except psycopg2.Error as e:
-        flash(f'Delete failed: {e.pgerror}', 'danger')
+    except psycopg.Error as e:
+        flash(f'Delete failed: {e}', 'danger')
     finally:
-        conn.close()
+        close_db(conn)
     
     return redirect(url_for('admin_schedules'))
 
 
 # --- Admin: View Users ---
 @app.route('/admin/users')
+@admin_required
 def view_users():
-    if 'user_id' not in session or not session.get('is_admin'):
-        flash('Access denied.', 'danger')
-        return redirect(url_for('dashboard'))
+    # Keyset pagination, same scheme as admin_history
+    after_created_at, after_id, limit = _page_args()
+    next_cursor = None
 
     conn = get_db()
-    cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+    cursor = conn.cursor(row_factory=dict_row)
     try:
-        cursor.execute('SELECT id, username, email, unit_number, is_admin, created_at FROM users')
+        query = 'SELECT id, username, email, unit_number, is_admin, created_at FROM users'
+        params = []
+
+        if after_created_at and after_id is not None:
+            query += ' WHERE (created_at, id) < (%s, %s)'
+            params.extend([after_created_at, after_id])
+
+        query += ' ORDER BY created_at DESC, id DESC LIMIT %s'
+        params.append(limit)
+
+        cursor.execute(query, params)
         users = cursor.fetchall()
+
+        if users and len(users) == limit:
+            last = users[-1]
+            next_cursor = {
+                'after_created_at': last['created_at'].isoformat(),
+                'after_id': last['id'],
+            }
     finally:
         cursor.close()
-        conn.close()
+        close_db(conn)
 
-    return render_template('admin_users.html', users=users)
+    return render_template('admin_users.html', users=users, next_cursor=next_cursor)
 
 
 # Admin history route
 @app.route('/admin/history', methods=['GET'])
+@admin_required
 def admin_history():
-    if 'user_id' not in session or not session.get('is_admin'):
-        flash('Unauthorized access!', 'danger')
-        return redirect(url_for('login'))
-
     conn = get_db()
-    cursor = conn.cursor()
+    # Plain client-side cursor: pagination bounds every variant of this
+    # query at 200 rows, so a server-side cursor would just add
+    # DECLARE/FETCH/CLOSE roundtrips
+    cursor = conn.cursor(binary=True, row_factory=dict_row)
     all_readings = []
 
     month = request.args.get('month', type=int)
     year = request.args.get('year', type=int)
 
+    # Keyset pagination: the cursor is the (created_at, id) of the last
+    # row on the previous page, so deep pages stay as cheap as page one
+    after_created_at, after_id, limit = _page_args()
+    next_cursor = None
+
     try:
+        # Timezone conversion and formatting happen in PostgreSQL so we
+        # don't pay per-row tz-conversion/strftime work in Python
         query = """
             SELECT mr.id, mr.reading, mr.notes, mr.created_at,
+                   to_char(mr.created_at AT TIME ZONE 'UTC' AT TIME ZONE %s, 'YYYY-MM-DD HH24:MI') AS formatted_date,
+                   to_char(mr.created_at AT TIME ZONE 'UTC' AT TIME ZONE %s, 'YYYY-MM-DD') AS date,
+                   to_char(mr.created_at AT TIME ZONE 'UTC' AT TIME ZONE %s, 'HH24:MI:SS') AS time,
                    u.username, u.unit_number
             FROM meter_readings mr
             JOIN users u ON mr.user_id = u.id
         """
-        params = []
+        params = [local_tz.key] * 3
         where_clauses = []
 
         if month and year:
-            start_of_month_local = datetime(year, month, 1, 0, 0, 0, tzinfo=local_tz)
-            end_day = monthrange(year, month)[1]
-            end_of_month_local = datetime(year, month, end_day, 23, 59, 59, tzinfo=local_tz)
-
-            start_date_utc = start_of_month_local.astimezone(pytz.utc).strftime('%Y-%m-%d %H:%M:%S')
-            end_date_utc = end_of_month_local.astimezone(pytz.utc).strftime('%Y-%m-%d %H:%M:%S')
+            # Pass datetimes directly: string bounds force PostgreSQL to
+            # cast per row and can defeat the index on created_at
+            start_date_utc, end_date_utc = _month_bounds_utc(year, month)
 
             where_clauses.append("mr.created_at BETWEEN %s AND %s")
             params.extend([start_date_utc, end_date_utc])
 
+        if after_created_at and after_id is not None:
+            where_clauses.append("(mr.created_at, mr.id) < (%s, %s)")
+            params.extend([after_created_at, after_id])
+
         if where_clauses:
             query += " WHERE " + " AND ".join(where_clauses)
 
-        # PostgreSQL supports casting with ::integer or CAST(... AS INTEGER)
-        query += " ORDER BY CAST(u.unit_number AS INTEGER) ASC, mr.created_at DESC"
+        # Ordering must match the keyset tuple for the seek to work
+        query += " ORDER BY mr.created_at DESC, mr.id DESC LIMIT %s"
+        params.append(limit)
 
         cursor.execute(query, params)
+        all_readings = cursor.fetchall()
 
-        rows = cursor.fetchall()
-        columns = [desc[0] for desc in cursor.description]
-
-        for row in rows:
-            reading = dict(zip(columns, row))
-            # Parse timestamp (assumes timestamptz returned as string or datetime)
-            created_at_utc = reading['created_at']
-            # If returned as datetime with tzinfo, use directly. If string, parse:
-            if isinstance(created_at_utc, str):
-                created_at_utc = datetime.strptime(created_at_utc, '%Y-%m-%d %H:%M:%S%z')
-            elif created_at_utc.tzinfo is None:
-                # If naive datetime, assume UTC
-                created_at_utc = created_at_utc.replace(tzinfo=pytz.utc)
-
-            created_at_local = created_at_utc.astimezone(local_tz)
-
-            reading['formatted_date'] = created_at_local.strftime('%Y-%m-%d %H:%M')
-            reading['date'] = created_at_local.strftime('%Y-%m-%d')
-            reading['time'] = created_at_local.strftime('%H:%M:%S')
-            all_readings.append(reading)
+        if all_readings and len(all_readings) == limit:
+            last = all_readings[-1]
+            next_cursor = {
+                'after_created_at': last['created_at'].isoformat(),
+                'after_id': last['id'],
+            }
 
     except Exception as e:
         flash(f"Error fetching history: {e}", 'danger')
     finally:
         cursor.close()
-       # close_db(conn)
+        close_db(conn)
 
     return render_template('admin_history.html',
                            readings=all_readings,
                            selected_month=month,
-                           selected_year=year)
+                           selected_year=year,
+                           next_cursor=next_cursor)
 
 
 # --- Admin: Unit Pincode Management ---
 # Updated unit pincode route
 @app.route('/admin/unit-pincode', methods=['GET', 'POST'])
+@admin_required
 def unit_pincode():
-    if not session.get('is_admin'):
-        flash('Access denied.', 'danger')
-        return redirect(url_for('dashboard'))
-
+    # One connection for the whole request, released exactly once below
     conn = get_db()
-    if request.method == 'POST':
-        unit_number = request.form['unit_number'].strip()
-
+    try:
+        if request.method == 'POST':
+            unit_number = request.form['unit_number'].strip()
+
+            try:
+                # Generate random 4-digit pincode
+                pin_code = ''.join(random.choices(string.digits, k=4))
+
+                # Single statement: the SELECT validates the unit exists,
+                # so no separate lookup roundtrip (and no race between
+                # checking and inserting); rowcount 0 means unknown unit
+                with conn.cursor() as cur:
+                    cur.execute("""
+                        INSERT INTO unit_pincode (unit_number, pin_code)
+                        SELECT u.unit_number, %s
+                        FROM users u
+                        WHERE u.unit_number = %s
+                        ON CONFLICT (unit_number) DO UPDATE
+                        SET pin_code = EXCLUDED.pin_code
+                    """, (pin_code, unit_number))
+                    conn.commit()
+                    if cur.rowcount == 0:
+                        flash('Unit number does not exist!', 'danger')
+                    else:
+                        flash('Pincode updated successfully', 'success')
+
+            except psycopg.Error as e:
+                conn.rollback()
+                flash(f'Database error: {e}', 'danger')
+            return redirect(url_for('unit_pincode'))
+
+        # GET request handling
         try:
-            # Validate unit exists
-            with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cur:
-                cur.execute("SELECT id FROM users WHERE unit_number = %s", (unit_number,))
-                if not cur.fetchone():
-                    flash('Unit number does not exist!', 'danger')
-                    return redirect(url_for('unit_pincode'))
-
-            # Generate random 4-digit pincode
-            pin_code = ''.join(random.choices(string.digits, k=4))
-
-            with conn.cursor() as cur:
+            # RealDictCursor rows are plain dicts, so no per-row dict()
+            # conversion pass is needed
+            with conn.cursor(row_factory=dict_row) as cur:
                 cur.execute("""
-                    INSERT INTO unit_pincode
-                    (unit_number, pin_code)
-                    VALUES (%s, %s)
-                    ON CONFLICT (unit_number) DO UPDATE
-                    SET pin_code = EXCLUDED.pin_code
-                """, (unit_number, pin_code))
-                conn.commit()
-                flash('Pincode updated successfully', 'success')
-
-        except Psycopg2Error as e:
-            conn.rollback()
-            flash(f'Database error: {e.pgerror}', 'danger')
-        finally:
-            conn.close()
-        return redirect(url_for('unit_pincode'))
-
-    # GET request handling
-    try:
-        with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cur:
-            cur.execute("""
-                SELECT up.id, up.unit_number, up.pin_code, up.created_at
-                FROM unit_pincode up
-                ORDER BY up.created_at DESC
-            """)
+                    SELECT up.id, up.unit_number, up.pin_code, up.created_at
+                    FROM unit_pincode up
+                    ORDER BY up.created_at DESC
+                """)
+                pincodes = []
+                for p in cur.fetchall():
+                    # Check if created_at is naive or already timezone-aware
+                    if p['created_at'].tzinfo is None:
+                        # If naive, assume UTC and convert in one call
+                        p['created_at'] = _to_local(p['created_at'])
+                    else:
+                        p['created_at'] = p['created_at'].astimezone(local_tz)
+
+                    pincodes.append(p)
+
+        except psycopg.Error as e:
+            flash(f'Database error: {e}', 'danger')
             pincodes = []
-            for row in cur.fetchall():
-                p = dict(row)
-                
-                # Check if created_at is naive or already timezone-aware
-                if p['created_at'].tzinfo is None:
-                    # If naive, assume UTC and localize
-                    p['created_at'] = pytz.utc.localize(p['created_at'])
-                # Now convert to local timezone, whether it was originally aware or just localized
-                p['created_at'] = p['created_at'].astimezone(local_tz)
-                
-                pincodes.append(p)
-
-    except Psycopg2Error as e:
-        flash(f'Database error: {e.pgerror}', 'danger')
-        pincodes = []
     finally:
-        conn.close()
+        close_db(conn)
 
     return render_template('unit_pincode.html',
                            pincodes=pincodes,
@@ -919,11 +1083,8 @@ def unit_pincode():
 
 # Delete pincode
 @app.route('/admin/delete-pincode/<string:unit_number>', methods=['POST'])
+@admin_required
 def delete_pincode(unit_number):
-    if not session.get('is_admin'):
-        flash('Access denied', 'danger')
-        return redirect(url_for('dashboard'))
-
     conn = get_db()
     try:
         with conn.cursor() as cursor:
@@ -933,55 +1094,62 @@ def delete_pincode(unit_number):
             else:
                 flash('No PIN code found for this unit', 'warning')
             conn.commit()
-    except psycopg2.Error as e:
-        flash(f'Delete failed: {e.pgerror}', 'danger')
+    except psycopg.Error as e:
+        flash(f'Delete failed: {e}', 'danger')
     finally:
-        conn.close()
+        close_db(conn)
     
     return redirect(url_for('unit_pincode'))
 
 
 # Admin Dashboard
 @app.route('/admin/dashboard')
+@admin_required
 def admin_dashboard():
-    if not session.get('is_admin'):
-        flash('Access denied.', 'danger')
-        return redirect(url_for('dashboard'))
-    
     conn = get_db()
     try:
-        with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cursor:
-            # System statistics
-            cursor.execute("SELECT COUNT(*) FROM users")
-            user_count = cursor.fetchone()[0]
-            
-            cursor.execute("SELECT COUNT(*) FROM meter_readings")
-            reading_count = cursor.fetchone()[0]
-            
-            cursor.execute("SELECT COUNT(*) FROM unit_pincode")
-            pincode_count = cursor.fetchone()[0]
-            
-            # Full user list
-            cursor.execute("""
-                SELECT id, username, unit_number, is_admin, created_at
-                FROM users 
-                ORDER BY created_at ASC
-            """)
-            all_users = cursor.fetchall()
-            
-            # Recent users
-            cursor.execute("""
-                SELECT username, unit_number 
-                FROM users 
-                ORDER BY created_at DESC 
-                LIMIT 5
-            """)
-            recent_users = cursor.fetchall()
-            
-    except psycopg2.Error as e:
-        flash(f'Database error: {e.pgerror}', 'danger')
+        # One cursor per pending result; the pipeline ships all five
+        # statements to the server in a single network roundtrip
+        c_users = conn.cursor()
+        c_readings = conn.cursor()
+        c_pincodes = conn.cursor()
+        c_all = conn.cursor(row_factory=dict_row)
+        c_recent = conn.cursor(row_factory=dict_row)
+        try:
+            with conn.pipeline():
+                # System statistics
+                c_users.execute("SELECT COUNT(*) FROM users")
+                c_readings.execute("SELECT COUNT(*) FROM meter_readings")
+                c_pincodes.execute("SELECT COUNT(*) FROM unit_pincode")
+
+                # Full user list
+                c_all.execute("""
+                    SELECT id, username, unit_number, is_admin, created_at
+                    FROM users
+                    ORDER BY created_at ASC
+                """)
+
+                # Recent users
+                c_recent.execute("""
+                    SELECT username, unit_number
+                    FROM users
+                    ORDER BY created_at DESC
+                    LIMIT 5
+                """)
+
+            user_count = c_users.fetchone()[0]
+            reading_count = c_readings.fetchone()[0]
+            pincode_count = c_pincodes.fetchone()[0]
+            all_users = c_all.fetchall()
+            recent_users = c_recent.fetchall()
+        finally:
+            for c in (c_users, c_readings, c_pincodes, c_all, c_recent):
+                c.close()
+
+    except psycopg.Error as e:
+        flash(f'Database error: {e}', 'danger')
     finally:
-        conn.close()
+        close_db(conn)
     
     return render_template('admin_dashboard.html',
                          user_count=user_count,
@@ -992,48 +1160,57 @@ def admin_dashboard():
 
 # Export the data
 @app.route('/admin/export')
+@admin_required
 def export_data():
-    if not session.get('is_admin'):
-        flash('Access denied.', 'danger')
-        return redirect(url_for('dashboard'))
-
     conn = get_db()
-    cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-    
-    try:
-        cursor.execute("""
-            SELECT u.unit_number, u.username, mr.reading, mr.notes, mr.created_at
+
+    # COPY writes the CSV bytes straight from the backend: no row
+    # parsing, no Python objects and no csv module in the loop. The zone
+    # name is inlined with sql.Literal because COPY takes no parameters.
+    copy_sql = pgsql.SQL("""
+        COPY (
+            SELECT u.unit_number AS "Unit Number",
+                   u.username AS "Username",
+                   mr.reading AS "Reading",
+                   coalesce(mr.notes, '') AS "Notes",
+                   to_char(mr.created_at AT TIME ZONE 'UTC' AT TIME ZONE {tz}, 'YYYY-MM-DD HH24:MI:SS') AS "Date"
             FROM meter_readings mr
             JOIN users u ON mr.user_id = u.id
             ORDER BY mr.created_at DESC
-        """)
-        
-        # Generate CSV content
-        csv_data = "Unit Number,Username,Reading,Notes,Date (UTC)\n"
-        for row in cursor:
-            # Properly escape quotes in notes
-            notes = row['notes'].replace('"', '""') if row['notes'] else ''
-            # Format datetime
-            created_at = row['created_at'].strftime('%Y-%m-%d %H:%M:%S')
-            csv_data += f'"{row["unit_number"]}","{row["username"]}",{row["reading"]},"{notes}","{created_at}"\n'
-        
-        # Create response with CSV headers
-        response = Response(
-            csv_data,
-            mimetype="text/csv",
-            headers={"Content-disposition": "attachment; filename=meter_readings.csv"}
-        )
-        return response
-        
-    except psycopg2.Error as e:
-        flash(f'Export failed: {e.pgerror}', 'danger')
-        return redirect(url_for('admin_dashboard'))
-    finally:
-        cursor.close()
-        conn.close()
+        ) TO STDOUT WITH CSV HEADER
+    """).format(tz=pgsql.Literal(local_tz.key))
+
+    def generate():
+        # psycopg's copy object is iterable, so the CSV streams out of
+        # the backend chunk by chunk, through gzip (level 1: cheap CPU,
+        # most of the ratio), without ever being buffered whole
+        out = io.BytesIO()
+        gz = gzip.GzipFile(fileobj=out, mode='wb', compresslevel=1)
+        try:
+            with conn.cursor() as cursor:
+                with cursor.copy(copy_sql) as copy:
+                    for data in copy:
+                        gz.write(bytes(data))
+                        if out.tell():
+                            yield out.getvalue()
+                            out.seek(0)
+                            out.truncate()
+            gz.close()
+            if out.tell():
+                yield out.getvalue()
+        finally:
+            close_db(conn)
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/csv",
+        headers={
+            "Content-disposition": "attachment; filename=meter_readings.csv",
+            "Content-Encoding": "gzip",
+        }
+    )
 
 
 # --- Initialize App ---
 if __name__ == '__main__':
-    #init_db()
     app.run(debug=True)
\ No newline at end of file
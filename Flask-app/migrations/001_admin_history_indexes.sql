@@ -0,0 +1,5 @@
+-- Index for the admin history page.
+-- The month filter does BETWEEN on meter_readings.created_at and joins
+-- back to users, so a composite index covers both.
+CREATE INDEX IF NOT EXISTS idx_meter_readings_created_at_user_id
+    ON meter_readings (created_at, user_id);